@@ -1,2 +1,2 @@
-from .idcquery import loads, load, load_from_url, load_from_github, get_yaml_error_text, interpret_template
+from .idcquery import loads, load, load_from_url, load_from_github, get_yaml_error_text, interpret_template, schema_to_result_columns, replace_result_columns_text
 
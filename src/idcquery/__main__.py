@@ -3,12 +3,15 @@ import json
 from google.cloud import bigquery
 import google.api_core
 from google.oauth2 import service_account
-from idcquery import load, load_from_url, get_yaml_error_text, interpret_template
+from idcquery import load, load_from_url, get_yaml_error_text, interpret_template, replace_result_columns_text
 import click
 import jsonschema
 import yaml
 from .markdown_utils import  concatenate_markdown_with_toc, concatenate_markdown_multi, get_path_component
 import os.path
+import concurrent.futures
+import tempfile
+import time
 
 @click.group()
 def cli():
@@ -156,6 +159,184 @@ def validate(querysrc, credentialfile, quiet, keep_going,
 
     sys.exit(ret_val)
 
+# -------------   resultcolumns ----------------- #
+@cli.command()
+@click.argument('querysrc', nargs=-1)
+@click.option('-c', '--credentialfile', envvar='GOOGLE_APPLICATION_CREDENTIALS',
+    required=True)
+@click.option('--check', is_flag=True, default=False,
+              help="verify queryResultColumns instead of writing them")
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=8,
+              help="number of dry run queries to run concurrently")
+@click.option('--cache-file', envvar='IDCQUERY_SCHEMA_CACHE', default=None,
+              help="JSON file used to cache result schemas by query fingerprint")
+@click.option('--max-age', type=click.FloatRange(min=0), default=None,
+              help="ignore cached schemas older than this many hours")
+@click.option('--refresh', is_flag=True, default=False,
+              help="ignore cached schemas and dry run every query")
+@click.option('-q', '--quiet', is_flag=True, default=False, 
+              help="don't print output, only set return value")
+def resultcolumns(querysrc, credentialfile, check, jobs, cache_file, max_age,
+                    refresh, quiet):
+    """Generate or verify queryResultColumns from the result schema of
+        a bigquery dry run of each query.  Descriptions of existing
+        columns are kept."""
+
+    credentials = service_account.Credentials.from_service_account_file(credentialfile)
+    client = bigquery.Client(credentials=credentials)
+
+    cache = {}
+    if cache_file:
+        cache = read_schema_cache(cache_file)
+
+    now = time.time()
+    cached = {}
+    if not refresh:
+        for fingerprint, entry in cache.items():
+            if max_age is None or now - entry['timestamp'] <= max_age * 3600:
+                cached[fingerprint] = entry['columns']
+
+    ret_val = 0
+    queryinfos = {}
+    fingerprints = {}
+    for q in querysrc:
+        try:
+            queryinfo = loadq(q)
+        except (yaml.scanner.ScannerError, yaml.YAMLError) as e:
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: read: {get_yaml_error_text(e)}')
+            continue
+        except OSError as e:
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: read: {e}')
+            continue
+
+        if queryinfo is None:
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: read: query description not found')
+            continue
+
+        try:
+            queryinfo.validate_format()
+        except jsonschema.exceptions.ValidationError as e:
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: format: {e.message}')
+            continue
+
+        queryinfos[q] = queryinfo
+        fingerprints[q] = queryinfo.get_fingerprint()
+
+    # one dry run per distinct fingerprint not already in the cache
+    pending = {}
+    for q, queryinfo in queryinfos.items():
+        if fingerprints[q] not in cached:
+            pending.setdefault(fingerprints[q], queryinfo)
+
+    errors = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(queryinfo.get_result_columns, client): fingerprint
+                        for fingerprint, queryinfo in pending.items()}
+            for future in concurrent.futures.as_completed(futures):
+                fingerprint = futures[future]
+                try:
+                    cached[fingerprint] = future.result()
+                    cache[fingerprint] = {'columns': cached[fingerprint], 
+                                          'timestamp': time.time()}
+                except google.api_core.exceptions.GoogleAPICallError as e:
+                    errors[fingerprint] = [f'{ee.get("reason", "error")}: {ee.get("message")}'
+                                            for ee in e.errors] or [str(e)]
+                except (google.api_core.exceptions.GoogleAPIError, 
+                            ValueError, TypeError, KeyError) as e:
+                    errors[fingerprint] = [f'{type(e).__name__}: {e}']
+    finally:
+        if cache_file:
+            write_schema_cache(cache_file, cache)
+
+    for q, queryinfo in queryinfos.items():
+        fingerprint = fingerprints[q]
+        if fingerprint in errors:
+            ret_val = 1
+            if not quiet:
+                for message in errors[fingerprint]:
+                    print(f'{q}: {message}')
+            continue
+
+        columns = cached[fingerprint]
+        if queryinfo.result_columns_match(columns):
+            continue
+
+        if check:
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: queryResultColumns do not match query result schema')
+            continue
+
+        if q.startswith('http'):
+            ret_val = 1
+            if not quiet:
+                print(f'{q}: cannot write queryResultColumns to a URL')
+            continue
+
+        columns = queryinfo.merge_result_columns(columns)
+        if q.endswith('.json'):
+            queryinfo.queryinfo['queryResultColumns'] = columns
+            text = json.dumps(queryinfo.queryinfo, indent=2, ensure_ascii=False) + '\n'
+        else:
+            with open(q) as fp:
+                try:
+                    text = replace_result_columns_text(fp.read(), columns)
+                except ValueError as e:
+                    ret_val = 1
+                    if not quiet:
+                        print(f'{q}: not written: {e}')
+                    continue
+        with open(q, 'w') as fp:
+            fp.write(text)
+        if not quiet:
+            print(f'{q}: wrote queryResultColumns')
+
+    sys.exit(ret_val)
+
+def read_schema_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as fp:
+            cache = json.load(fp)
+    except ValueError:
+        print(f'{cache_file}: ignoring unreadable schema cache', file=sys.stderr)
+        return {}
+
+    if not isinstance(cache, dict):
+        print(f'{cache_file}: ignoring unreadable schema cache', file=sys.stderr)
+        return {}
+
+    valid = {fingerprint: entry for fingerprint, entry in cache.items()
+                if is_schema_cache_entry(entry)}
+    if len(valid) != len(cache):
+        print(f'{cache_file}: ignoring {len(cache) - len(valid)} invalid schema cache entries',
+              file=sys.stderr)
+    return valid
+
+def is_schema_cache_entry(entry):
+    return (isinstance(entry, dict) 
+            and isinstance(entry.get('columns'), list)
+            and isinstance(entry.get('timestamp'), (int, float))
+            and not isinstance(entry.get('timestamp'), bool))
+
+def write_schema_cache(cache_file, cache):
+    # write to a temporary file and rename so a crash can't leave a partial cache
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.tmp', 
+                                     delete=False) as fp:
+        json.dump(cache, fp, indent=2)
+    os.replace(fp.name, cache_file)
+
 # -------------   format  ----------------- #
 @cli.command('format')
 @click.argument('querysrc', nargs=-1)
@@ -6,6 +6,8 @@ from google.cloud import bigquery
 from jinja2 import Environment, BaseLoader, Undefined
 import importlib.resources
 import jsonschema
+import hashlib
+import yaml
 import re
 
 
@@ -48,6 +50,10 @@ MODULE_NAME = 'idcquery'
     "queryParameters" in the query description.
 
     * run_query(queryinfo, client, parameter_values={}, job_config_args={})
+
+    The get_result_columns method dry runs the query and returns its
+    result schema in "queryResultColumns" form, so the documented
+    columns can be generated or checked against the actual query.
 """
 
 class QueryInfo:
@@ -179,7 +185,7 @@ class IDCQueryInfo(QueryInfo):
                                                     pv)
                     query_parameters.append(qp)
                 elif 'arrayType' in p:
-                    pv = parameter_values.get(p['name'], p('defaultValue', None))
+                    pv = parameter_values.get(p['name'], p.get('defaultValue'))
                     if not isinstance(pv, list):
                         pv = json.dumps(pv)
 
@@ -196,6 +202,38 @@ class IDCQueryInfo(QueryInfo):
         return client.query(query, job_config = jq)
             
     
+    def get_result_columns(self, client, parameter_values = {}, job_config_args = {}):
+        """Returns the result columns of the query as a list of 
+        queryResultColumns entries. The columns are read from the schema
+        of a dry run of the query, so the query is not executed."""
+        job = self.run_query(client, parameter_values, job_config_args, dry_run=True)
+        if job.schema is None:
+            raise ValueError("dry run returned no result schema")
+        return schema_to_result_columns(job.schema)
+
+    def get_fingerprint(self):
+        """Returns a hash of the query text and the names and types of its
+        query parameters. Queries with the same fingerprint normally have
+        the same result schema, but the schema can still change if the
+        tables or views the query reads from change."""
+        params = [{k: p.get(k) for k in ('name', 'type', 'arrayType')} 
+                    for p in (self.queryinfo.get('queryParameters') or [])]
+        text = json.dumps({'query': self.get_query(), 'queryParameters': params},
+                          sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def merge_result_columns(self, columns):
+        """Returns a copy of the result columns with the descriptions
+        of any matching columns in queryResultColumns carried over."""
+        return merge_result_columns(columns, self.queryinfo.get('queryResultColumns'))
+
+    def result_columns_match(self, columns):
+        """Returns True if the queryResultColumns of the description
+        have the same names, types, and modes as the given result columns.
+        Column descriptions are ignored."""
+        existing = self.queryinfo.get('queryResultColumns') or []
+        return strip_result_columns(existing) == strip_result_columns(columns)
+
     def validate_format(self, schema=None):
         """Validate the format of the queryinfo format using JSON schema.
         If no schema is provided, a default schema will be used."""
@@ -242,6 +280,137 @@ def get_yaml_error_text(exc):
     else:
         return f'yaml parse error'
 
+# legacy SQL type names returned in job schemas, mapped to the
+# standard SQL names used for queryParameters
+STANDARD_SQL_TYPES = {
+    'INTEGER': 'INT64',
+    'FLOAT': 'FLOAT64',
+    'BOOLEAN': 'BOOL',
+    'RECORD': 'STRUCT'
+}
+
+def schema_to_result_columns(schema):
+    """Convert a list of BigQuery SchemaFields to queryResultColumns
+    entries. The mode is only included if it is not NULLABLE, and
+    STRUCT columns list their subcolumns as fields."""
+    columns = []
+    for field in schema:
+        column = {
+            'name': field.name,
+            'type': STANDARD_SQL_TYPES.get(field.field_type, field.field_type)
+        }
+        if field.mode and field.mode != 'NULLABLE':
+            column['mode'] = field.mode
+        if field.fields:
+            column['fields'] = schema_to_result_columns(field.fields)
+        columns.append(column)
+    return columns
+
+# key order of queryResultColumns entries written by merge_result_columns
+RESULT_COLUMN_KEYS = ('name', 'description', 'type', 'mode', 'fields')
+
+def merge_result_columns(columns, existing):
+    """Return a copy of columns with the descriptions of the columns
+    of the same name in existing carried over. Keys are written in
+    the order of RESULT_COLUMN_KEYS, so the output doesn't depend on 
+    the key order of columns."""
+    existing_by_name = {c.get('name'): c for c in (existing or [])}
+    merged = []
+    for column in columns:
+        old = existing_by_name.get(column['name'], {})
+        column = dict(column)
+        if 'description' in old:
+            column['description'] = old['description']
+        if 'fields' in column:
+            column['fields'] = merge_result_columns(column['fields'], old.get('fields'))
+        new = {k: column[k] for k in RESULT_COLUMN_KEYS if k in column}
+        new.update({k: v for k, v in column.items() if k not in new})
+        merged.append(new)
+    return merged
+
+def strip_result_columns(columns):
+    """Return result columns without descriptions and with the default
+    NULLABLE mode removed, for comparison."""
+    stripped = []
+    for column in columns:
+        c = {'name': column.get('name'), 'type': column.get('type')}
+        if column.get('mode', 'NULLABLE') != 'NULLABLE':
+            c['mode'] = column['mode']
+        if column.get('fields'):
+            c['fields'] = strip_result_columns(column['fields'])
+        stripped.append(c)
+    return stripped
+
+class BlockStyleDumper(yaml.SafeDumper):
+    """A YAML dumper that writes multi-line strings as | block scalars,
+    the way descriptions are usually written by hand."""
+
+def represent_str_block(dumper, data):
+    style = '|' if '\n' in data else None
+    return dumper.represent_scalar('tag:yaml.org,2002:str', data, style=style)
+
+BlockStyleDumper.add_representer(str, represent_str_block)
+
+def replace_result_columns_text(querytext, columns):
+    """Return the text of a YAML query description with its top-level
+    queryResultColumns replaced by columns, leaving the rest of the text
+    (including comments and block formatting) untouched. If there is no
+    queryResultColumns entry, one is appended. Raises ValueError if the 
+    new text doesn't parse to the same description with only 
+    queryResultColumns changed."""
+    block = yaml.dump({'queryResultColumns': columns}, Dumper=BlockStyleDumper,
+                      sort_keys=False, default_flow_style=False,
+                      allow_unicode=True)
+    lines = querytext.splitlines(keepends=True)
+    start = None
+    for i, line in enumerate(lines):
+        if re.match(r'^queryResultColumns\s*:', line):
+            start = i
+            break
+
+    if start is None:
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        text = ''.join(lines) + block
+    else:
+        # the entry ends at the next top-level key or document marker;
+        # trailing blank lines and comments belong to whatever follows
+        end = start + 1
+        last = start + 1
+        while end < len(lines):
+            line = lines[end]
+            if re.match(r'^(---|\.\.\.)(\s|$)', line):
+                break
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                end += 1
+                continue
+            if not line[0].isspace() and not line.startswith('-'):
+                break
+            end += 1
+            last = end
+        text = ''.join(lines[:start]) + block + ''.join(lines[last:])
+
+    check_result_columns_text(querytext, text, columns)
+    return text
+
+def check_result_columns_text(oldtext, newtext, columns):
+    """Raise ValueError unless newtext parses to the same description as
+    oldtext with queryResultColumns set to columns."""
+    try:
+        old = yaml_load(oldtext)
+        new = yaml_load(newtext)
+    except yaml.YAMLError as e:
+        raise ValueError(f'rewritten description does not parse: {e}')
+
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        raise ValueError('description is not a mapping')
+    if new.get('queryResultColumns') != columns:
+        raise ValueError('rewritten queryResultColumns do not match the result schema')
+    old.pop('queryResultColumns', None)
+    new.pop('queryResultColumns')
+    if old != new:
+        raise ValueError('rewriting queryResultColumns would change other fields')
+
 def read_template(template_name):
     return (importlib.resources.files(MODULE_NAME)
                     .joinpath(TEMPLATE_ROOT, template_name)
@@ -0,0 +1,207 @@
+from types import SimpleNamespace
+
+import pytest
+
+from idcquery import loads, schema_to_result_columns, replace_result_columns_text
+from idcquery.idcquery import merge_result_columns, strip_result_columns
+
+
+def field(name, field_type, mode='NULLABLE', fields=()):
+    return SimpleNamespace(name=name, field_type=field_type, mode=mode, fields=fields)
+
+
+COLUMNS = [
+    {'name': 'a', 'type': 'INT64'},
+    {'name': 'b', 'type': 'STRING'},
+]
+
+
+def test_schema_to_result_columns_maps_legacy_types():
+    schema = [field('i', 'INTEGER'), field('f', 'FLOAT'), 
+              field('b', 'BOOLEAN'), field('s', 'STRING')]
+    assert schema_to_result_columns(schema) == [
+        {'name': 'i', 'type': 'INT64'},
+        {'name': 'f', 'type': 'FLOAT64'},
+        {'name': 'b', 'type': 'BOOL'},
+        {'name': 's', 'type': 'STRING'},
+    ]
+
+
+def test_schema_to_result_columns_nested_record():
+    schema = [field('r', 'RECORD', 'REPEATED', 
+                    [field('x', 'INTEGER', 'REQUIRED'), field('y', 'STRING')])]
+    assert schema_to_result_columns(schema) == [
+        {'name': 'r', 'type': 'STRUCT', 'mode': 'REPEATED', 'fields': [
+            {'name': 'x', 'type': 'INT64', 'mode': 'REQUIRED'},
+            {'name': 'y', 'type': 'STRING'},
+        ]}
+    ]
+
+
+def test_merge_keeps_descriptions():
+    existing = [
+        {'name': 'a', 'description': 'the a column', 'type': 'integer'},
+        {'name': 'r', 'description': 'a record', 
+         'fields': [{'name': 'x', 'description': 'the x field'}]},
+        {'name': 'gone', 'description': 'no longer returned'},
+    ]
+    columns = [
+        {'name': 'a', 'type': 'INT64'},
+        {'name': 'r', 'type': 'STRUCT', 'fields': [
+            {'name': 'x', 'type': 'STRING'}, {'name': 'y', 'type': 'STRING'}]},
+    ]
+    assert merge_result_columns(columns, existing) == [
+        {'name': 'a', 'description': 'the a column', 'type': 'INT64'},
+        {'name': 'r', 'description': 'a record', 'type': 'STRUCT', 'fields': [
+            {'name': 'x', 'description': 'the x field', 'type': 'STRING'},
+            {'name': 'y', 'type': 'STRING'}]},
+    ]
+
+
+def test_nullable_mode_same_as_missing():
+    assert (strip_result_columns([{'name': 'a', 'type': 'INT64', 'mode': 'NULLABLE'}]) ==
+            strip_result_columns([{'name': 'a', 'type': 'INT64'}]))
+    assert (strip_result_columns([{'name': 'a', 'type': 'INT64', 'mode': 'REPEATED'}]) !=
+            strip_result_columns([{'name': 'a', 'type': 'INT64'}]))
+
+
+def test_result_columns_match_ignores_descriptions():
+    queryinfo = loads('query: SELECT 1\n'
+                      'queryResultColumns:\n'
+                      '- name: a\n'
+                      '  description: the a column\n'
+                      '  type: INT64\n'
+                      '  mode: NULLABLE\n'
+                      '- name: b\n'
+                      '  type: STRING\n')
+    assert queryinfo.result_columns_match(COLUMNS)
+
+
+def test_replace_entry_in_middle():
+    text = ('title: t\n'
+            'queryResultColumns:\n'
+            '- name: old\n'
+            '  type: integer\n'
+            'query: |\n'
+            '  SELECT 1\n')
+    result = replace_result_columns_text(text, COLUMNS)
+    assert result.startswith('title: t\nqueryResultColumns:\n- name: a\n')
+    assert result.endswith('query: |\n  SELECT 1\n')
+    assert loads(result)['queryResultColumns'] == COLUMNS
+
+
+def test_replace_entry_at_end():
+    text = ('query: SELECT 1\n'
+            'queryResultColumns:\n'
+            '- name: old\n')
+    result = replace_result_columns_text(text, COLUMNS)
+    assert result.startswith('query: SELECT 1\nqueryResultColumns:\n')
+    assert 'old' not in result
+    assert loads(result)['queryResultColumns'] == COLUMNS
+
+
+def test_replace_no_entry():
+    text = '# a comment\nquery: SELECT 1'
+    result = replace_result_columns_text(text, COLUMNS)
+    assert result.startswith('# a comment\nquery: SELECT 1\nqueryResultColumns:\n')
+    assert loads(result)['queryResultColumns'] == COLUMNS
+
+
+def test_replace_indented_list_items():
+    text = ('queryResultColumns:\n'
+            '  - name: old\n'
+            '    type: integer\n'
+            '  - name: older\n'
+            'query: SELECT 1\n')
+    result = replace_result_columns_text(text, COLUMNS)
+    assert 'old' not in result
+    assert result.endswith('query: SELECT 1\n')
+    assert loads(result)['queryResultColumns'] == COLUMNS
+
+
+def test_replace_keeps_trailing_comments():
+    text = ('queryResultColumns:\n'
+            '- name: old\n'
+            '\n'
+            '# the query\n'
+            'query: SELECT 1  # inline\n')
+    result = replace_result_columns_text(text, COLUMNS)
+    assert result.endswith('\n\n# the query\nquery: SELECT 1  # inline\n')
+
+
+def test_replace_stops_at_document_marker():
+    text = ('---\n'
+            'title: x\n'
+            'query: SELECT 1\n'
+            'queryResultColumns:\n'
+            '- name: a\n'
+            '...\n')
+    result = replace_result_columns_text(text, COLUMNS)
+    assert result.startswith('---\n')
+    assert result.endswith('...\n')
+    assert loads(result)['queryResultColumns'] == COLUMNS
+
+
+def test_replace_refuses_to_change_other_fields():
+    # a flow-style entry continues past the top-level line, so the
+    # splice would damage the description
+    text = ('queryResultColumns: [\n'
+            '{name: old}]\n'
+            'query: SELECT 1\n')
+    with pytest.raises(ValueError):
+        replace_result_columns_text(text, COLUMNS)
+
+
+def test_merge_uses_fixed_key_order():
+    columns = [{'mode': 'REPEATED', 'type': 'STRUCT', 'name': 's', 
+                'fields': [{'type': 'STRING', 'name': 'x'}]}]
+    existing = [{'name': 's', 'description': 'a struct'}]
+    merged = merge_result_columns(columns, existing)
+    assert list(merged[0]) == ['name', 'description', 'type', 'mode', 'fields']
+    assert list(merged[0]['fields'][0]) == ['name', 'type']
+
+
+def test_replace_keeps_multiline_description_as_block():
+    text = ('query: SELECT 1\n'
+            'queryResultColumns:\n'
+            '- name: a\n'
+            '  description: >\n'
+            '    a long\n'
+            '    description\n'
+            '\n'
+            '    with two paragraphs\n')
+    queryinfo = loads(text)
+    columns = queryinfo.merge_result_columns([{'name': 'a', 'type': 'INT64'}])
+    result = replace_result_columns_text(text, columns)
+    assert result == ('query: SELECT 1\n'
+                      'queryResultColumns:\n'
+                      '- name: a\n'
+                      '  description: |\n'
+                      '    a long description\n'
+                      '    with two paragraphs\n'
+                      '  type: INT64\n')
+    assert loads(result)['queryResultColumns'] == columns
+
+
+def test_get_result_columns_without_schema():
+    class Client:
+        def query(self, query, job_config):
+            return SimpleNamespace(schema=None)
+
+    queryinfo = loads('query: CREATE TABLE t (a INT64)')
+    with pytest.raises(ValueError, match='dry run returned no result schema'):
+        queryinfo.get_result_columns(Client())
+
+
+def test_get_fingerprint():
+    def fingerprint(query, param_type='STRING', default='a'):
+        return loads(f'query: {query}\n'
+                     'queryParameters:\n'
+                     '- name: p\n'
+                     f'  type: {param_type}\n'
+                     f'  defaultValue: {default}\n').get_fingerprint()
+
+    assert fingerprint('SELECT @p') == fingerprint('SELECT @p')
+    assert fingerprint('SELECT @p') == fingerprint('SELECT @p', default='b')
+    assert fingerprint('SELECT @p') != fingerprint('SELECT @p', param_type='INT64')
+    assert fingerprint('SELECT @p') != fingerprint('SELECT @p AS q')
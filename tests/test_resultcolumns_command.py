@@ -0,0 +1,180 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import google.api_core.exceptions
+import pytest
+import yaml
+from click.testing import CliRunner
+
+import idcquery.__main__ as main
+
+
+def field(name, field_type, mode='NULLABLE', fields=()):
+    return SimpleNamespace(name=name, field_type=field_type, mode=mode, fields=fields)
+
+
+SCHEMAS = {
+    'SELECT 1': [field('a', 'INTEGER'), field('t', 'STRING', 'REPEATED')],
+    'SELECT 2': [field('b', 'STRING')],
+    'SELECT 3': [field('c', 'FLOAT')],
+}
+
+
+class StubClient:
+    """Stands in for bigquery.Client, returning dry run jobs with
+    schemas from SCHEMAS and recording each query."""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def query(self, query, job_config):
+        assert job_config.dry_run
+        with self.lock:
+            self.queries.append(query)
+        if query == 'SELECT missing':
+            raise google.api_core.exceptions.NotFound('Not found: Table missing')
+        return SimpleNamespace(schema=SCHEMAS[query])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = StubClient()
+    monkeypatch.setattr(main.service_account.Credentials, 'from_service_account_file',
+                        lambda credentialfile: None)
+    monkeypatch.setattr(main.bigquery, 'Client', lambda credentials: client)
+    return client
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'cache.json')
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def run(*args):
+    return CliRunner().invoke(main.cli, ['resultcolumns', '-c', 'credentials.json', *args])
+
+
+def test_writes_columns_and_dedupes_by_fingerprint(client, tmp_path, cache_file):
+    one = write(tmp_path / 'one.yaml', 'title: one\nquery: SELECT 1\n')
+    same = write(tmp_path / 'same.yaml', 'title: same\nquery: SELECT 1\n')
+    two = write(tmp_path / 'two.yaml', 'query: SELECT 2\n')
+
+    result = run('--cache-file', cache_file, '-j', '2', one, same, two)
+
+    assert result.exit_code == 0, result.output
+    assert sorted(client.queries) == ['SELECT 1', 'SELECT 2']
+    assert yaml.safe_load(open(one))['queryResultColumns'] == [
+        {'name': 'a', 'type': 'INT64'},
+        {'name': 't', 'type': 'STRING', 'mode': 'REPEATED'},
+    ]
+    assert open(same).read().startswith('title: same\nquery: SELECT 1\n')
+    assert yaml.safe_load(open(two))['queryResultColumns'] == [{'name': 'b', 'type': 'STRING'}]
+
+    cache = json.load(open(cache_file))
+    assert len(cache) == 2
+    for entry in cache.values():
+        assert isinstance(entry['columns'], list)
+        assert isinstance(entry['timestamp'], float)
+
+
+def test_check_exit_status(client, tmp_path, cache_file):
+    one = write(tmp_path / 'one.yaml', 'query: SELECT 1\n')
+
+    result = run('--check', '--cache-file', cache_file, one)
+    assert result.exit_code == 1
+    assert 'do not match' in result.stdout
+    assert open(one).read() == 'query: SELECT 1\n'
+
+    assert run('--cache-file', cache_file, one).exit_code == 0
+    assert run('--check', '--cache-file', cache_file, one).exit_code == 0
+    assert client.queries == ['SELECT 1']
+
+
+def test_cache_hit_writes_same_layout(client, tmp_path, cache_file):
+    uncached = write(tmp_path / 'uncached.yaml', 'query: SELECT 1\n')
+    cached = write(tmp_path / 'cached.yaml', 'query: SELECT 1\n')
+
+    assert run(uncached).exit_code == 0
+    assert run('--check', '--cache-file', cache_file, cached).exit_code == 1
+    assert run('--cache-file', cache_file, cached).exit_code == 0
+
+    assert open(cached).read() == open(uncached).read()
+
+
+def test_refresh_and_max_age(client, tmp_path, cache_file):
+    one = write(tmp_path / 'one.yaml', 'query: SELECT 1\n')
+
+    run('--check', '--cache-file', cache_file, one)
+    run('--check', '--cache-file', cache_file, '--max-age', '1', one)
+    assert len(client.queries) == 1
+
+    run('--check', '--cache-file', cache_file, '--refresh', one)
+    assert len(client.queries) == 2
+
+    cache = json.load(open(cache_file))
+    for entry in cache.values():
+        entry['timestamp'] -= 2 * 3600
+    json.dump(cache, open(cache_file, 'w'))
+
+    run('--check', '--cache-file', cache_file, '--max-age', '3', one)
+    assert len(client.queries) == 2
+    run('--check', '--cache-file', cache_file, '--max-age', '1', one)
+    assert len(client.queries) == 3
+
+
+def test_json_description_rewrite(client, tmp_path):
+    path = write(tmp_path / 'one.json',
+                 json.dumps({'title': 'Überblick', 'query': 'SELECT 1'}))
+
+    assert run(path).exit_code == 0
+
+    text = open(path, encoding='utf-8').read()
+    assert 'Überblick' in text
+    description = json.loads(text)
+    assert description['title'] == 'Überblick'
+    assert description['queryResultColumns'][0] == {'name': 'a', 'type': 'INT64'}
+
+
+def test_errors_are_reported_per_file(client, tmp_path, cache_file):
+    ok = write(tmp_path / 'ok.yaml', 'query: SELECT 2\n')
+    missing_table = write(tmp_path / 'missing_table.yaml', 'query: SELECT missing\n')
+    no_query = write(tmp_path / 'no_query.yaml', 'title: no query\n')
+    missing_file = str(tmp_path / 'missing_file.yaml')
+
+    result = run('--cache-file', cache_file, ok, missing_table, no_query, missing_file)
+
+    assert result.exit_code == 1
+    assert f'{missing_table}: 404 Not found: Table missing' in result.stdout
+    assert f'{no_query}: format:' in result.stdout
+    assert f'{missing_file}: read:' in result.stdout
+    assert 'queryResultColumns' in open(ok).read()
+    assert len(json.load(open(cache_file))) == 1
+
+
+@pytest.mark.parametrize('cache', [
+    [],
+    {'x': 'not an entry'},
+    {'x': {'columns': []}},
+    {'x': {'columns': [], 'timestamp': 'yesterday'}},
+])
+def test_invalid_cache_is_ignored(client, tmp_path, cache_file, cache):
+    json.dump(cache, open(cache_file, 'w'))
+    one = write(tmp_path / 'one.yaml', 'query: SELECT 1\n')
+
+    result = run('--cache-file', cache_file, '--max-age', '1', one)
+
+    assert result.exit_code == 0, result.output
+    assert 'ignoring' in result.stderr
+    assert client.queries == ['SELECT 1']
+
+
+def test_jobs_must_be_positive(client, tmp_path):
+    one = write(tmp_path / 'one.yaml', 'query: SELECT 1\n')
+    assert run('-j', '0', one).exit_code == 2